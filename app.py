@@ -1,17 +1,118 @@
 import os
 import io
 import re
-from collections import Counter
-from flask import Flask, render_template, request, redirect, url_for, flash, session
-from sklearn.feature_extraction.text import TfidfVectorizer, CountVectorizer
-import math
+import codecs
+import gzip
+import hashlib
+import json
+import secrets
+import zlib
+from functools import partial
+import threading
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from itertools import chain
+from flask import Flask, Response, jsonify, render_template, request, redirect, url_for, flash, get_flashed_messages, session
+import multiprocessing
+import numpy as np
+from cachelib import FileSystemCache
+from charset_normalizer import from_bytes
+
+try:
+    # Опционально: ускоренный подсчет слов для ASCII-текста
+    import numba
+except ImportError:
+    numba = None
 
 # --- Конфигурация ---
 app = Flask(__name__)
-# Секретный ключ для использования сессий (нужно для flash сообщений и хранения данных между запросами)
-app.config['SECRET_KEY'] = os.urandom(24)
+# Секретный ключ для использования сессий (нужно для flash сообщений и хранения данных между запросами).
+# Берется из переменной окружения, чтобы сессии переживали перезапуск и были общими для всех
+# процессов-обработчиков. Случайный ключ - только запасной вариант для локальной разработки
+app.config['SECRET_KEY'] = os.environ.get('FLASK_SECRET_KEY') or secrets.token_hex(32)
 # Пагинация: количество элементов на странице
 ITEMS_PER_PAGE = 50
+# Сколько страниц результатов доступно: хранится и сортируется только топ MAX_DISPLAY слов
+MAX_PAGES = 10
+MAX_DISPLAY = ITEMS_PER_PAGE * MAX_PAGES
+# Регулярное выражение для токенизации: компилируется один раз при импорте.
+# Ограничение длины {3,} отсекает слова из 1-2 символов прямо в движке регулярных выражений
+_TOKEN_RE = re.compile(r'\b[a-zа-яё-]{3,}\b')
+# Серверный кэш результатов: в сессии (cookie) хранится только ключ, а не весь список слов.
+# Ключ - хэш содержимого файла, поэтому повторная загрузка того же файла не пересчитывается.
+# Кэш хранится в файлах: он общий для всех процессов и сохраняется при перезапуске.
+# Записи живут 30 минут, всего хранится не более 128 записей.
+# Записи кэша - pickle, поэтому каталог должен быть доступен только пользователю приложения:
+# по умолчанию он лежит в каталоге экземпляра приложения (instance/), а не в общем /tmp
+RESULTS_CACHE_DIR = os.environ.get('RESULTS_CACHE_DIR', os.path.join(app.instance_path, 'results_cache'))
+os.makedirs(RESULTS_CACHE_DIR, mode=0o700, exist_ok=True)
+if hasattr(os, 'getuid'):
+    # Каталог мог быть создан заранее кем-то другим - такой кэш использовать нельзя
+    _cache_dir_stat = os.stat(RESULTS_CACHE_DIR)
+    if _cache_dir_stat.st_uid != os.getuid() or _cache_dir_stat.st_mode & 0o077:
+        raise RuntimeError(f'Каталог кэша {RESULTS_CACHE_DIR} должен принадлежать пользователю приложения и иметь права 0700')
+_RESULTS_CACHE = FileSystemCache(RESULTS_CACHE_DIR, threshold=128, default_timeout=1800)
+# Версия формата записей кэша: входит в ключ, чтобы записи старого формата с диска не читались
+# после обновления приложения.
+# Запись: (результаты, число уникальных слов, приближенный ли подсчет, сжатые страницы)
+RESULTS_CACHE_FORMAT = 'v4'
+# Размер куска текста (в символах) для параллельного подсчета слов.
+# Файлы меньше одного куска обрабатываются в текущем процессе, без накладных расходов на пул
+PARALLEL_CHUNK_SIZE = 1024 * 1024
+# Размер общего пула процессов для подсчета слов (в каждом процессе приложения) и сколько
+# кусков на процесс может ждать в очереди, пока основной поток декодирует следующие.
+# Пул создается в каждом процессе приложения, поэтому под gunicorn с несколькими
+# процессами задайте PARALLEL_WORKERS=1: подсчет пойдет в самом обработчике, без пула
+PARALLEL_WORKERS = int(os.environ.get('PARALLEL_WORKERS') or min(os.cpu_count() or 1, 4))
+PARALLEL_PREFETCH = 2
+# Размер блока (в байтах) при вычислении хэша файла
+HASH_BLOCK_SIZE = 1024 * 1024
+# Метки порядка байтов (BOM) и соответствующие кодировки. UTF-32 проверяется раньше UTF-16,
+# так как BOM UTF-32 LE начинается с BOM UTF-16 LE
+_BOM_ENCODINGS = (
+    (codecs.BOM_UTF32_LE, 'utf-32'),
+    (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+)
+# Определение кодировки файлов не в UTF-8: charset-normalizer выбирает только среди кодировок,
+# реально встречающихся в русских и английских текстах, в порядке предпочтения при равных
+# оценках (без этого ограничения на коротких текстах он
+# принимает CP1251 за cp1006 или big5). Образец - ENCODING_SAMPLE_SIZE байт, начиная с первого
+# не-ASCII байта. Если результат ненадежен (chaos выше ENCODING_MAX_CHAOS), читаем как CP1251
+_DETECTABLE_ENCODINGS = ['cp1251', 'koi8_r', 'cp866', 'cp1252']
+ENCODING_SAMPLE_SIZE = 64 * 1024
+ENCODING_MAX_CHAOS = 0.3
+_NON_ASCII_RE = re.compile(rb'[\x80-\xff]')
+# Предел числа уникальных слов. При его превышении (например, в логах с UUID) подсчет
+# переключается на хэширование признаков в массив фиксированного размера HASH_BUCKETS,
+# чтобы память не росла неограниченно. Частоты слов, попавших в одну корзину, суммируются
+VOCABULARY_LIMIT = 500_000
+HASH_BUCKETS = 1 << 20
+# В режиме хэширования в таблицу попадают только слова-представители корзин, встретившиеся
+# не меньше HASHED_MIN_COUNT раз (одиночные UUID и т.п. - шум)
+HASHED_MIN_COUNT = 2
+# Стоп-слова (исключаются по желанию пользователя). Слова короче 3 символов
+# и так отбрасываются токенизатором, поэтому здесь их нет
+_STOP_EN = frozenset('''
+    about above after again against all and any are because been before being below between both
+    but can could did does doing down during each few for from further had has have having her here
+    hers herself him himself his how into its itself just more most myself nor not now off once only
+    other our ours ourselves out over own same she should some such than that the their theirs them
+    themselves then there these they this those through too under until very was were what when where
+    which while who whom why will with would you your yours yourself yourselves
+'''.split())
+_STOP_RU = frozenset('''
+    без более больше будет будто был была были было быть вам вас весь вот все всегда всего всех всё
+    где даже для другой его еще ещё если есть здесь или иногда как какая какой когда кто куда между
+    меня мне много может можно мой моя над надо наконец нас него нее неё ней нельзя нет ним них ничего
+    она они опять особо перед под после потом потому почти при про раз разве свое своё себе себя
+    сейчас совсем так такой там тебя тем теперь тогда того тоже только том тот три тут уже хорошо
+    хоть чего чем через что чтоб чтобы чуть эти это этого этой этом этот
+'''.split())
+STOP_WORDS = _STOP_EN | _STOP_RU
 
 
 # --- Вспомогательные функции ---
@@ -22,89 +123,524 @@ def preprocess_text(text):
     - Приведение к нижнему регистру
     - Удаление пунктуации и цифр (оставляем только слова)
     - Удаление слишком коротких слов (длиной 1-2 символа)
+
+    Возвращает:
+        list: Список слов.
     """
-    text = text.lower()
-    # Оставляем только слова (буквы и, возможно, дефисы внутри слов)
-    words = re.findall(r'\b[a-zа-яё-]+\b', text)
-    # Фильтруем короткие слова
-    words = [word for word in words if len(word) > 2]
-    return " ".join(words) # Возвращаем строку для Vectorizer
+    # Оставляем только слова (буквы и, возможно, дефисы внутри слов) длиной от 3 символов
+    return _TOKEN_RE.findall(text.lower())
 
-def calculate_tf_idf(text_content):
+def file_digest(stream):
     """
-    Рассчитывает TF и IDF для слов в тексте.
+    Вычисляет хэш BLAKE2b содержимого бинарного потока, читая его блоками.
 
     Возвращает:
-        list: Список словарей вида {'word': слово, 'tf': частота, 'idf': значение idf}
-              или None в случае ошибки.
-        int: Общее количество уникальных слов до среза.
+        str: Шестнадцатеричная строка хэша (32 символа).
+    """
+    stream.seek(0)
+    digest = hashlib.blake2b(digest_size=16)
+    for block in iter(lambda: stream.read(HASH_BLOCK_SIZE), b''):
+        digest.update(block)
+    return digest.hexdigest()
+
+def read_encoding_sample(stream):
+    """
+    Читает образец для определения кодировки: до ENCODING_SAMPLE_SIZE байт, начиная
+    с первого не-ASCII байта (ASCII-начало файла ничего не говорит о кодировке).
+    Файл просматривается блоками, в памяти держится не больше одного блока.
+    """
+    stream.seek(0)
+    offset = 0
+    for block in iter(lambda: stream.read(HASH_BLOCK_SIZE), b''):
+        if not block.isascii():
+            stream.seek(offset + _NON_ASCII_RE.search(block).start())
+            return stream.read(ENCODING_SAMPLE_SIZE)
+        offset += len(block)
+    return b''
+
+def _lowercase_share(text):
+    """
+    Доля строчных среди букв текста.
+    """
+    letters = [char for char in text if char.isalpha()]
+    return sum(char.islower() for char in letters) / len(letters) if letters else 0.0
+
+def _best_encoding_match(matches):
+    """
+    Выбирает лучший результат charset-normalizer: с наименьшим chaos и наибольшей coherence.
+    На коротких текстах CP1251 и KOI8-R часто равны по этим оценкам (одна кодировка
+    превращает строчные буквы другой в прописные), поэтому при равенстве выбирается
+    вариант с большей долей строчных букв - обычный текст набран в основном строчными,
+    а затем - более распространенная кодировка (по порядку в _DETECTABLE_ENCODINGS).
+    """
+    if not matches:
+        return None
+    return min(
+        matches,
+        key=lambda match: (
+            round(match.chaos, 2),
+            -round(match.coherence, 2),
+            -round(_lowercase_share(str(match)), 2),
+            _DETECTABLE_ENCODINGS.index(match.encoding),
+        ),
+    )
+
+def iter_candidate_encodings(stream):
+    """
+    Перебирает кодировки, в которых стоит попробовать прочитать файл:
+    - кодировку по BOM, если он есть (и только ее);
+    - иначе UTF-8;
+    - затем кодировку, определенную charset-normalizer по образцу файла
+      (см. read_encoding_sample), а если определить ее надежно не удалось - CP1251.
+
+    Определение выполняется лениво, только если файл не прочитался как UTF-8.
+    """
+    stream.seek(0)
+    head = stream.read(4)
+    for bom, encoding in _BOM_ENCODINGS:
+        if head.startswith(bom):
+            yield encoding
+            return
+
+    yield 'utf-8'
+
+    best = _best_encoding_match(from_bytes(read_encoding_sample(stream), cp_isolation=_DETECTABLE_ENCODINGS))
+    if best is not None and best.chaos <= ENCODING_MAX_CHAOS:
+        yield best.encoding
+    else:
+        yield 'cp1251'
+
+def iter_decoded_lines(stream, encoding):
+    """
+    Построчно читает бинарный поток и декодирует его.
+    Файл целиком в памяти не хранится.
+
+    Используется инкрементальный декодер, а строки заново разбиваются по символу
+    перевода строки: в многобайтовых кодировках (например, UTF-16) байт 0x0A
+    может оказаться частью другого символа.
+
+    Выбрасывает UnicodeDecodeError, если текст не декодируется в указанной кодировке.
     """
-    if not text_content.strip():
-        return [], 0 # Возвращаем пустой список, если текст пустой
+    stream.seek(0)
+    decoder = codecs.getincrementaldecoder(encoding)()
+    pending = ''
+    for raw_line in stream:
+        text = pending + decoder.decode(raw_line)
+        head, newline, pending = text.rpartition('\n')
+        if newline:
+            yield head + newline
+    yield pending + decoder.decode(b'', final=True)
+
+def iter_text_chunks(lines, chunk_size=PARALLEL_CHUNK_SIZE):
+    """
+    Группирует строки в куски текста размером около chunk_size символов.
+    Куски режутся только по границам строк, поэтому слова не разрываются.
+    """
+    buffer = []
+    buffer_size = 0
+    for line in lines:
+        buffer.append(line)
+        buffer_size += len(line)
+        if buffer_size >= chunk_size:
+            yield "".join(buffer)
+            buffer = []
+            buffer_size = 0
+    if buffer:
+        yield "".join(buffer)
+
+if numba is not None:
+    @numba.njit(cache=True, nogil=True)
+    def _count_ascii_tokens(buf):
+        """
+        Скомпилированный аналог Counter(preprocess_text(text)) для ASCII-текста,
+        переданного как массив байтов. Повторяет семантику _TOKEN_RE (включая границы \\b),
+        но не создает Python-строку на каждое слово: слова считаются по хэшу FNV-1a.
+
+        Возвращает:
+            Массивы начала, конца (первого вхождения) и частоты каждого уникального слова
+            и признак коллизии хэшей (в этом случае результат использовать нельзя).
+        """
+        n = buf.shape[0]
+        # Внутри непрерывного участка из букв и дефисов находится не больше одного слова
+        # (конец берется самый дальний), слово - не короче 3 байтов, а участки разделены
+        # хотя бы одним байтом. Значит, для t слов нужно 3t + (t - 1) <= n байтов,
+        # то есть t <= (n + 1) / 4 <= n // 4 + 1
+        max_tokens = n // 4 + 1
+        starts = np.empty(max_tokens, dtype=np.int64)
+        ends = np.empty(max_tokens, dtype=np.int64)
+        counts = np.zeros(max_tokens, dtype=np.int64)
+        slots = numba.typed.Dict.empty(key_type=numba.types.uint64, value_type=numba.types.int64)
+        unique = 0
+
+        i = 0
+        while i < n:
+            # Ищем непрерывный участок из букв a-z/A-Z и дефисов
+            c = buf[i]
+            if not (97 <= c <= 122 or 65 <= c <= 90 or c == 45):
+                i += 1
+                continue
+            j = i
+            while j < n and (97 <= buf[j] <= 122 or 65 <= buf[j] <= 90 or buf[j] == 45):
+                j += 1
+
+            # Внутри участка ищем слова так же, как re.findall: начало и конец на границе \b,
+            # конец - самый дальний из возможных, длина от 3 символов
+            p = i
+            while p < j:
+                if _is_word_byte(buf, p - 1) != _is_word_byte(buf, p):
+                    q = j
+                    while q >= p + 3 and _is_word_byte(buf, q - 1) == _is_word_byte(buf, q):
+                        q -= 1
+                    if q >= p + 3:
+                        h = np.uint64(14695981039346656037)
+                        for k in range(p, q):
+                            h ^= np.uint64(buf[k] | 32) # | 32 переводит A-Z в нижний регистр, a-z и '-' не меняет
+                            h *= np.uint64(1099511628211)
+                        if h not in slots:
+                            assert unique < max_tokens
+                            slots[h] = unique
+                            starts[unique] = p
+                            ends[unique] = q
+                            counts[unique] = 1
+                            unique += 1
+                        else:
+                            # Сверяем слово с первым вхождением, чтобы не склеить разные слова
+                            slot = slots[h]
+                            s0 = starts[slot]
+                            if ends[slot] - s0 != q - p:
+                                return starts[:0], ends[:0], counts[:0], True
+                            for k in range(q - p):
+                                if (buf[s0 + k] | 32) != (buf[p + k] | 32):
+                                    return starts[:0], ends[:0], counts[:0], True
+                            counts[slot] += 1
+                        p = q
+                        continue
+                p += 1
+            i = j
+
+        return starts[:unique], ends[:unique], counts[:unique], False
+
+    @numba.njit(cache=True, nogil=True)
+    def _is_word_byte(buf, i):
+        """
+        Проверяет, является ли байт символом слова для \\b (буква, цифра или '_').
+        Позиции за пределами буфера словом не считаются.
+        """
+        if i < 0 or i >= buf.shape[0]:
+            return False
+        c = buf[i]
+        return 97 <= c <= 122 or 65 <= c <= 90 or 48 <= c <= 57 or c == 95
+
+def _tokenize_count(chunk, stop_words=frozenset()):
+    """
+    Подсчитывает слова в куске текста. Выполняется в дочернем процессе пула.
+    Для ASCII-текста при наличии numba используется скомпилированный подсчет.
+    Стоп-слова удаляются из готового подсчета: это один проход по короткому
+    множеству вместо проверки каждого слова текста.
+    """
+    counts = None
+    if numba is not None and chunk.isascii():
+        chunk_bytes = chunk.encode('ascii')
+        starts, ends, ascii_counts, collision = _count_ascii_tokens(np.frombuffer(chunk_bytes, dtype=np.uint8))
+        if not collision:
+            counts = Counter({
+                chunk_bytes[start:end].decode('ascii').lower(): int(count)
+                for start, end, count in zip(starts, ends, ascii_counts)
+            })
+    if counts is None:
+        counts = Counter(preprocess_text(chunk))
+    for word in stop_words:
+        counts.pop(word, None)
+    return counts
+
+def _fold_into_buckets(counts, buckets, representatives, representative_counts):
+    """
+    Добавляет частоты слов в массив корзин (feature hashing).
 
-    processed_text = preprocess_text(text_content)
-    words_list = processed_text.split() # Получаем список слов для Counter
+    Первое слово, попавшее в корзину, становится ее представителем для отображения.
+    Для представителя отдельно ведется его собственная частота: все вхождения слова
+    попадают в одну корзину, поэтому она точная, в отличие от суммы по корзине,
+    в которую входят и другие слова с тем же хэшем. Слова добавляются по убыванию
+    частоты, чтобы корзины занимали прежде всего частые слова.
+    """
+    for word, count in counts.most_common():
+        # Старшие биты после умножения на константу Фибоначчи: младшие биты crc32 на похожих
+        # словах распределены неравномерно, что портит оценку числа уникальных слов
+        bucket = ((zlib.crc32(word.encode('utf-8')) * 0x9E3779B1) & 0xFFFFFFFF) >> (32 - HASH_BUCKETS.bit_length() + 1)
+        buckets[bucket] += count
+        if representatives[bucket] is None:
+            representatives[bucket] = word
+        if representatives[bucket] == word:
+            representative_counts[bucket] += count
+
+def warm_up_numba():
+    """
+    Прогревает скомпилированный подсчет слов (или загружает его из дискового кэша numba),
+    чтобы первый кусок текста в процессе не ждал компиляции. Без numba ничего не делает.
+    """
+    if numba is not None:
+        _count_ascii_tokens(np.frombuffer(b'warm up', dtype=np.uint8))
 
-    if not words_list:
-        return [], 0 # Если после обработки слов не осталось
+_POOL = None
+_POOL_LOCK = threading.Lock()
 
+def _get_pool():
+    """
+    Возвращает общий пул процессов для подсчета слов, создавая его при первом вызове.
+    Пул создается один раз на процесс приложения, а не на каждую загрузку.
+
+    Процессы запускаются через forkserver (или spawn, где его нет), а не fork:
+    дочерние процессы не наследуют потоки и состояние многопоточного обработчика.
+    Поэтому они не получают и прогретый numba-код, и каждый прогревает его сам при старте.
+    """
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is None:
+            start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            _POOL = ProcessPoolExecutor(
+                max_workers=PARALLEL_WORKERS,
+                mp_context=multiprocessing.get_context(start_method),
+                initializer=warm_up_numba,
+            )
+        return _POOL
+
+def _reset_pool():
+    """
+    Сбрасывает общий пул, если он сломан (например, дочерний процесс аварийно завершился).
+    Следующий вызов _get_pool() создаст новый пул.
+    """
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is not None:
+            _POOL.shutdown(wait=False, cancel_futures=True)
+            _POOL = None
+
+def count_words(lines, stop_words=frozenset()):
+    """
+    Подсчитывает частоты слов в потоке строк, исключая слова из stop_words.
+
+    Если текст больше одного куска (PARALLEL_CHUNK_SIZE), куски обрабатываются
+    параллельно в общем пуле процессов (re не освобождает GIL, поэтому потоки не помогут),
+    а частичные результаты объединяются. Пока пул считает, основной поток декодирует
+    следующие куски; в очереди держится не больше PARALLEL_WORKERS * PARALLEL_PREFETCH
+    кусков, чтобы в памяти не накапливался весь файл. При PARALLEL_WORKERS <= 1 куски
+    считаются по очереди в текущем процессе.
+
+    Если уникальных слов больше VOCABULARY_LIMIT, дальнейший подсчет ведется по
+    корзинам хэшей. Тогда возвращаются только слова-представители корзин, встретившиеся
+    не меньше HASHED_MIN_COUNT раз (с их точными частотами), часть слов может
+    отсутствовать, а число уникальных слов оценивается по заполненности корзин.
+
+    Возвращает:
+        Counter: Словарь {слово: частота}.
+        int: Число уникальных слов (в режиме хэширования - оценка).
+        bool: Был ли подсчет приближенным (режим хэширования).
+    """
+    chunks = iter_text_chunks(lines)
+    first_chunk = next(chunks, "")
+    second_chunk = next(chunks, None)
+    if second_chunk is None:
+        tf_counts = _tokenize_count(first_chunk, stop_words)
+        return tf_counts, len(tf_counts), False
+
+    tf_counts = Counter()
+    buckets = None
+    representatives = None
+    representative_counts = None
+
+    def merge(partial_counts):
+        # Добавляет частичный подсчет; при превышении VOCABULARY_LIMIT переходит на корзины хэшей
+        nonlocal tf_counts, buckets, representatives, representative_counts
+        if buckets is not None:
+            _fold_into_buckets(partial_counts, buckets, representatives, representative_counts)
+            return
+        tf_counts.update(partial_counts)
+        if len(tf_counts) > VOCABULARY_LIMIT:
+            buckets = np.zeros(HASH_BUCKETS, dtype=np.int64)
+            representatives = np.empty(HASH_BUCKETS, dtype=object)
+            representative_counts = np.zeros(HASH_BUCKETS, dtype=np.int64)
+            _fold_into_buckets(tf_counts, buckets, representatives, representative_counts)
+            tf_counts = None
+
+    all_chunks = chain((first_chunk, second_chunk), chunks)
+    if PARALLEL_WORKERS <= 1:
+        for chunk in all_chunks:
+            merge(_tokenize_count(chunk, stop_words))
+    else:
+        pool = _get_pool()
+        tokenize_count = partial(_tokenize_count, stop_words=stop_words)
+        max_pending = PARALLEL_WORKERS * PARALLEL_PREFETCH
+        pending = deque()
+        try:
+            for chunk in all_chunks:
+                pending.append(pool.submit(tokenize_count, chunk))
+                if len(pending) >= max_pending:
+                    merge(pending.popleft().result())
+            while pending:
+                merge(pending.popleft().result())
+        except BrokenProcessPool:
+            _reset_pool()
+            raise
+        finally:
+            # Например, при ошибке декодирования: оставшиеся куски больше не нужны
+            for future in pending:
+                future.cancel()
+
+    if buckets is not None:
+        shown = np.flatnonzero(representative_counts >= HASHED_MIN_COUNT)
+        # Оценка числа уникальных слов по доле занятых корзин (linear counting)
+        occupied = min(np.count_nonzero(buckets), HASH_BUCKETS - 1)
+        estimated_unique = int(round(-HASH_BUCKETS * np.log1p(-occupied / HASH_BUCKETS)))
+        return Counter(dict(zip(representatives[shown], representative_counts[shown].tolist()))), estimated_unique, True
+    return tf_counts, len(tf_counts), False
+
+def calculate_tf_idf(lines, stop_words=frozenset()):
+    """
+    Рассчитывает TF и IDF для слов в тексте.
+
+    Принимает:
+        lines: Итерируемый объект со строками текста (например, iter_decoded_lines()).
+        stop_words: Множество слов, которые не учитываются (например, STOP_WORDS).
+
+    Возвращает:
+        tuple: Три выровненных массива NumPy (слова, tf, idf) для топ MAX_DISPLAY слов,
+               отсортированных по убыванию IDF, или None в случае ошибки.
+        int: Общее количество уникальных слов до среза.
+        bool: Был ли подсчет приближенным (см. count_words).
+    """
     # 1. Рассчитываем TF (Term Frequency) - сколько раз каждое слово встречается
-    # Используем Counter для простого подсчета
-    tf_counts = Counter(words_list)
-
-    # 2. Рассчитываем IDF (Inverse Document Frequency) с помощью scikit-learn
-    # TfidfVectorizer подходит для TF-IDF, но для получения чистого IDF удобнее использовать
-    # его внутренний механизм. В контексте одного документа IDF будет одинаковым для всех слов.
-    # Используем stop_words='english' или 'russian' если известен язык,
-    # но для универсальности пока не будем их жестко задавать,
-    # т.к. предобработка уже сделала часть работы.
-    # Важно: TfidfVectorizer внутри себя тоже выполняет токенизацию и предобработку,
-    # поэтому важно, чтобы она была согласована с нашей ручной предобработкой (или полагаться только на Vectorizer).
-    # Здесь для демонстрации мы используем его IDF компонент.
+    tf_counts, total_unique_words, approximate = count_words(lines, stop_words)
+
+    if not tf_counts:
+        # Если текст пустой или после обработки слов не осталось
+        empty = (np.array([], dtype=object), np.array([], dtype=np.int64), np.array([], dtype=np.float32))
+        return empty, total_unique_words, approximate
+
+    # 2. Рассчитываем IDF (Inverse Document Frequency)
+    # Для одного документа сглаженный IDF (как в scikit-learn, smooth_idf=True)
+    # вычисляется в замкнутой форме: log((1 + 1) / (1 + 1)) + 1 = 1.0 для любого слова.
+    # Поэтому нет смысла повторно токенизировать текст через TfidfVectorizer -
+    # достаточно слов, уже посчитанных Counter.
+    # Для корпуса из нескольких документов см. calculate_idf().
 
     try:
-        # Используем TfidfVectorizer для расчета IDF.
-        # smooth_idf=True и use_idf=True включены по умолчанию.
-        # Нормализация ('norm') не влияет на сам IDF.
-        # Мы передаем текст как список из одного документа.
-        vectorizer = TfidfVectorizer(use_idf=True, smooth_idf=True, token_pattern=r'\b[a-zа-яё-]+\b', min_df=1)
-
-        # Обучаем векторизатор на нашем тексте (одном документе)
-        tfidf_matrix = vectorizer.fit_transform([processed_text])
-
-        # Получаем словарь {слово: индекс}
-        feature_names = vectorizer.get_feature_names_out()
-        # Получаем значения IDF для каждого слова в словаре
-        idf_values = vectorizer.idf_
-
-        # Создаем словарь {слово: idf}
-        idf_dict = dict(zip(feature_names, idf_values))
-
-        # 3. Собираем результаты
-        results = []
-        for word in feature_names: # Итерируем по словам, найденным векторизатором
-            if word in tf_counts: # Убеждаемся, что слово есть в наших TF подсчетах
-                 results.append({
-                     'word': word,
-                     'tf': tf_counts[word],
-                     'idf': idf_dict.get(word, 0.0) # Используем get для безопасности
-                 })
+        # 3. Собираем результаты в три параллельных массива вместо списка словарей:
+        # так они занимают в разы меньше памяти, а срез страницы не копирует данные
+        vocabulary_size = len(tf_counts)
+        words = np.fromiter(tf_counts.keys(), dtype=object, count=vocabulary_size)
+        tfs = np.fromiter(tf_counts.values(), dtype=np.int64, count=vocabulary_size)
+        idfs = np.ones(vocabulary_size, dtype=np.float32)
 
         # 4. Сортируем результаты по убыванию IDF
         # ВАЖНО: Как отмечено, для одного документа IDF будет одинаковым (1.0) для всех слов.
         # Поэтому сортировка по IDF не даст уникального ранжирования.
-        # Можно добавить вторичную сортировку, например, по TF (убывание) или по слову (алфавит).
-        # results.sort(key=lambda item: (-item['idf'], -item['tf'], item['word']))
-        results.sort(key=lambda item: item['idf'], reverse=True)
-
-        total_unique_words = len(results)
+        # Вторичный ключ - TF (убывание); lexsort устойчив и работает в нативном коде.
+        # Полностью сортируется только топ MAX_DISPLAY: так как IDF одинаков для всех слов,
+        # топ отбирается по TF за O(N). Пороговое значение TF находится частичной сортировкой;
+        # берутся все слова с TF выше порога и первые по порядку появления слова с TF, равным
+        # порогу, - ровно те же слова, что дала бы полная устойчивая сортировка.
+        if vocabulary_size > MAX_DISPLAY:
+            threshold = np.partition(tfs, vocabulary_size - MAX_DISPLAY)[vocabulary_size - MAX_DISPLAY]
+            above = np.flatnonzero(tfs > threshold)
+            tied = np.flatnonzero(tfs == threshold)[:MAX_DISPLAY - len(above)]
+            top = np.sort(np.concatenate((above, tied)))
+        else:
+            top = np.arange(vocabulary_size)
+        order = top[np.lexsort((-tfs[top], -idfs[top]))]
 
         # Возвращаем все результаты и общее количество
-        return results, total_unique_words
+        return (words[order], tfs[order], idfs[order]), total_unique_words, approximate
 
     except Exception as e:
         print(f"Ошибка при расчете TF-IDF: {e}")
-        return None, 0
+        return None, 0, False
+
+def results_page(results, start, end):
+    """
+    Преобразует срез результатов в список словарей для шаблона.
+
+    Возвращает:
+        list: Список словарей вида {'word': слово, 'tf': частота, 'idf': значение idf}.
+    """
+    words, tfs, idfs = results
+    return [
+        {'word': word, 'tf': int(tf), 'idf': float(idf)}
+        for word, tf, idf in zip(words[start:end], tfs[start:end], idfs[start:end])
+    ]
+
+def build_gzipped_pages(results):
+    """
+    Заранее сериализует каждую страницу результатов в JSON и сжимает gzip.
+    Сжатие выполняется один раз при загрузке файла, а не при каждом запросе страницы.
+
+    Возвращает:
+        list: Список сжатых страниц (bytes); для пустых результатов - одна пустая страница.
+    """
+    total = len(results[0])
+    return [
+        gzip.compress(json.dumps(results_page(results, start, start + ITEMS_PER_PAGE), ensure_ascii=False).encode('utf-8'))
+        for start in range(0, max(total, 1), ITEMS_PER_PAGE)
+    ]
+
+def _iter_pages(current, total_pages, edge=2, around=3):
+    """
+    Генерирует номера страниц для навигации: edge страниц в начале и в конце
+    и around страниц вокруг текущей. Пропуски обозначаются None.
+    """
+    pages = sorted({
+        *range(1, min(edge, total_pages) + 1),
+        *range(max(current - around, 1), min(current + around, total_pages) + 1),
+        *range(max(total_pages - edge + 1, 1), total_pages + 1),
+    })
+    last = 0
+    for number in pages:
+        if number - last > 1:
+            yield None
+        yield number
+        last = number
+
+def paginate(page, total, per_page=ITEMS_PER_PAGE):
+    """
+    Формирует данные для постраничной навигации.
+
+    Возвращает:
+        dict: Номер страницы, число страниц, наличие соседних страниц и т.п.
+    """
+    # Деление с округлением вверх в целых числах, без перехода к float
+    total_pages = -(-total // per_page)
+    return {
+        'page': page,
+        'per_page': per_page,
+        'total': total,
+        'total_pages': total_pages,
+        'has_prev': page > 1,
+        'has_next': page < total_pages,
+        'prev_num': page - 1 if page > 1 else None,
+        'next_num': page + 1 if page < total_pages else None,
+        # Номера страниц для отображения: только окно вокруг текущей и края
+        'iter_pages': list(_iter_pages(page, total_pages))
+    }
+
+def calculate_idf(corpus):
+    """
+    Рассчитывает IDF для слов по корпусу из нескольких документов.
+
+    Принимает:
+        corpus: Итерируемый объект со строками-документами.
+
+    Возвращает:
+        dict: Словарь {слово: значение idf}.
+
+    Требует scikit-learn (опциональная зависимость): импорт выполняется только
+    при вызове, чтобы не замедлять запуск приложения.
+    """
+    from sklearn.feature_extraction.text import TfidfVectorizer
+
+    # Передаем preprocess_text как analyzer, чтобы токенизация совпадала с calculate_tf_idf
+    vectorizer = TfidfVectorizer(use_idf=True, smooth_idf=True, analyzer=preprocess_text, min_df=1)
+    # Обучаем векторизатор один раз; для IDF матрица документов не нужна, поэтому только fit
+    vectorizer.fit(corpus)
+    return dict(zip(vectorizer.get_feature_names_out(), vectorizer.idf_))
 
 
 # --- Маршруты Flask ---
@@ -130,30 +666,43 @@ def index():
         # Проверка типа файла (простое расширение)
         if file and file.filename.lower().endswith('.txt'):
             try:
-                # Читаем содержимое файла безопасно
-                # Используем io.BytesIO и декодируем в UTF-8 (самая частая кодировка)
-                # Добавляем обработку ошибок декодирования
-                file_content_bytes = file.read()
-                try:
-                    file_content = file_content_bytes.decode('utf-8')
-                except UnicodeDecodeError:
-                     try:
-                         # Попытка с другой распространенной кодировкой
-                         file_content = file_content_bytes.decode('cp1251')
-                     except UnicodeDecodeError:
-                         flash('Не удалось прочитать файл. Убедитесь, что он в кодировке UTF-8 или CP1251.', 'error')
-                         return redirect(request.url)
-
-                # Рассчитываем TF-IDF
-                all_results, total_words = calculate_tf_idf(file_content)
-
-                if all_results is None:
-                    flash('Произошла ошибка при обработке файла.', 'error')
-                    return redirect(request.url)
-
-                # Сохраняем все результаты в сессию для пагинации
-                session['all_results'] = all_results
+                # Исключать ли стоп-слова (флажок в форме)
+                stop_words = STOP_WORDS if request.form.get('filterStopWords') else frozenset()
+
+                # Если этот файл уже обрабатывался, берем результаты из кэша по хэшу содержимого.
+                # Результаты со стоп-словами и без них кэшируются отдельно
+                results_key = f'{RESULTS_CACHE_FORMAT}-{file_digest(file.stream)}'
+                if stop_words:
+                    results_key += '-nostop'
+                cached = _RESULTS_CACHE.get(results_key)
+
+                if cached is not None:
+                    all_results, total_words, approximate, _ = cached
+                else:
+                    # Читаем файл построчно, не загружая его целиком в память.
+                    # Кодировки перебираются по очереди (см. iter_candidate_encodings);
+                    # при ошибке декодирования подсчет начинается заново с начала файла.
+                    for encoding in iter_candidate_encodings(file.stream):
+                        try:
+                            # Рассчитываем TF-IDF
+                            all_results, total_words, approximate = calculate_tf_idf(iter_decoded_lines(file.stream, encoding), stop_words)
+                            break
+                        except UnicodeDecodeError:
+                            continue
+                    else:
+                        flash('Не удалось определить кодировку файла. Сохраните его в UTF-8 или CP1251.', 'error')
+                        return redirect(request.url)
+
+                    if all_results is None:
+                        flash('Произошла ошибка при обработке файла.', 'error')
+                        return redirect(request.url)
+
+                    # Сохраняем все результаты в серверный кэш для пагинации, а в сессию - только ключ
+                    _RESULTS_CACHE.set(results_key, (all_results, total_words, approximate, build_gzipped_pages(all_results)))
+
+                session['results_key'] = results_key
                 session['total_words'] = total_words
+                session['approximate'] = approximate
                 session['filename'] = file.filename
 
                 # Перенаправляем на GET запрос первой страницы результатов
@@ -170,44 +719,43 @@ def index():
     page = request.args.get('page', 1, type=int) # Получаем номер страницы из URL
     results_to_display = None
     pagination_data = None
+    all_results = None
+
+    if 'results_key' in session:
+        cached = _RESULTS_CACHE.get(session['results_key'])
+        if cached is not None:
+            all_results = cached[0]
+        else:
+            # Результаты устарели и удалены из кэша - сбрасываем данные сессии
+            for key in ('results_key', 'total_words', 'approximate', 'filename'):
+                session.pop(key, None)
+
     filename = session.get('filename') # Получаем имя файла из сессии
 
-    if 'all_results' in session:
-        all_results = session['all_results']
+    if all_results is not None:
         total_words = session.get('total_words', 0)
+        # Для пагинации доступен только сохраненный топ слов
+        total_shown = len(all_results[0])
 
         # Логика пагинации
         start_index = (page - 1) * ITEMS_PER_PAGE
         end_index = start_index + ITEMS_PER_PAGE
-        results_to_display = all_results[start_index:end_index]
-
-        total_pages = math.ceil(total_words / ITEMS_PER_PAGE)
+        results_to_display = results_page(all_results, start_index, end_index)
 
         # Формируем данные для пагинации в шаблоне
-        pagination_data = {
-            'page': page,
-            'per_page': ITEMS_PER_PAGE,
-            'total': total_words,
-            'total_pages': total_pages,
-            'has_prev': page > 1,
-            'has_next': page < total_pages,
-            'prev_num': page - 1 if page > 1 else None,
-            'next_num': page + 1 if page < total_pages else None,
-            # Простая генерация номеров страниц для отображения (можно улучшить)
-            'iter_pages': lambda: range(1, total_pages + 1)
-        }
+        pagination_data = paginate(page, total_shown)
 
         # Показываем только топ N если пагинация не нужна была бы
         # results_to_display = all_results[:ITEMS_PER_PAGE]
 
         # Если на текущей странице нет результатов (например, запрошена страница > max),
         # но результаты вообще есть, перенаправим на первую
-        if not results_to_display and page > 1 and all_results:
+        if not results_to_display and page > 1 and total_shown:
              return redirect(url_for('index', page=1))
 
 
-    # Получаем flash сообщения
-    error_messages = session.pop('_flashes', []) # Используем стандартный механизм flash
+    # Получаем flash сообщения об ошибках через стандартный механизм Flask
+    error_messages = get_flashed_messages(with_categories=True, category_filter=['error'])
 
     # Отображаем шаблон
     return render_template(
@@ -215,12 +763,40 @@ def index():
         results=results_to_display,
         pagination=pagination_data,
         total_words=session.get('total_words'),
+        approximate=session.get('approximate', False),
+        hashed_min_count=HASHED_MIN_COUNT,
         filename=filename,
-        error=next((msg[1] for msg in error_messages if msg[0] == 'error'), None) # Передаем только последнее сообщение об ошибке
+        error=error_messages[-1][1] if error_messages else None # Передаем только последнее сообщение об ошибке
         # Можно передать все сообщения, если нужно
     )
 
+@app.route('/api/results')
+def api_results():
+    """
+    JSON API: страница результатов последнего загруженного файла.
+    Отдает заранее сжатую страницу с Content-Encoding: gzip, если клиент его поддерживает.
+    """
+    cached = _RESULTS_CACHE.get(session['results_key']) if 'results_key' in session else None
+    if cached is None:
+        return jsonify(error='Нет результатов анализа. Загрузите файл.'), 404
+
+    gzipped_pages = cached[3]
+    page = request.args.get('page', 1, type=int)
+    if not 1 <= page <= len(gzipped_pages):
+        return jsonify(error='Страница не найдена.'), 404
+
+    body = gzipped_pages[page - 1]
+    headers = {'Vary': 'Accept-Encoding'}
+    # Учитываем q-значения: 'gzip;q=0' означает, что gzip клиенту не подходит
+    if request.accept_encodings['gzip'] > 0:
+        headers['Content-Encoding'] = 'gzip'
+    else:
+        body = gzip.decompress(body)
+    return Response(body, mimetype='application/json', headers=headers)
+
 # --- Запуск приложения ---
+# Встроенный сервер Flask - только для разработки. В продакшене приложение запускается
+# через gunicorn с модулем wsgi.py (см. README)
 if __name__ == '__main__':
-    # debug=True полезен для разработки, но его следует отключить в продакшене
-    app.run(debug=True)
\ No newline at end of file
+    # Режим отладки включается только явно: FLASK_ENV=development
+    app.run(debug=os.environ.get('FLASK_ENV') == 'development')
\ No newline at end of file
@@ -0,0 +1,52 @@
+"""
+Регрессионная проверка ускоренного подсчета слов на numba:
+результат должен совпадать с Counter(preprocess_text(...)).
+
+Запуск из корня проекта: python -m unittest
+"""
+import random
+import unittest
+from collections import Counter
+
+import numpy as np
+
+from app import _tokenize_count, numba, preprocess_text
+
+if numba is not None:
+    from app import _count_ascii_tokens
+
+
+@unittest.skipIf(numba is None, 'numba не установлена')
+class CountAsciiTokensTest(unittest.TestCase):
+
+    def assertMatchesRegex(self, text):
+        self.assertEqual(_tokenize_count(text), Counter(preprocess_text(text)), repr(text))
+
+    def test_edge_cases(self):
+        for text in ['', 'ab', 'abc', 'ABC abc Abc', 'abc-def', '-abc-', '--- a-b', 'abc_def abc1 1abc',
+                     'x-yz', 'abc-1', 'abc--', 'well-known -- word\n', 'a-b-c-d e_f-gh']:
+            self.assertMatchesRegex(text)
+
+    def test_random_text(self):
+        rng = random.Random(0)
+        alphabet = 'aB-c _1.,zZ\n'
+        for _ in range(5000):
+            self.assertMatchesRegex(''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 40))))
+
+    def test_random_words(self):
+        rng = random.Random(1)
+        words = [''.join(rng.choice('abcdeXYZ-') for _ in range(rng.randint(1, 8))) for _ in range(2000)]
+        self.assertMatchesRegex(' '.join(rng.choice(words) for _ in range(50000)))
+
+    def test_max_tokens_bound(self):
+        # Самый плотный текст: разные слова из 3 букв через один пробел, n = 4t - 1
+        words = [a + b + c for a in 'abcdefghij' for b in 'klmnopqrst' for c in 'uvwxyz']
+        text = ' '.join(words)
+        starts, ends, counts, collision = _count_ascii_tokens(np.frombuffer(text.encode('ascii'), dtype=np.uint8))
+        self.assertFalse(collision)
+        self.assertEqual(len(starts), len(words))
+        self.assertLessEqual(len(starts), len(text) // 4 + 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,21 @@
+"""
+Точка входа WSGI для продакшен-сервера:
+
+    PARALLEL_WORKERS=1 gunicorn -w $(nproc) --preload --threads 2 --timeout 120 wsgi:app
+
+Каждый процесс gunicorn создает собственный пул из PARALLEL_WORKERS процессов для
+подсчета слов, так что всего считающих процессов около -w * PARALLEL_WORKERS. Чтобы
+не превышать число ядер, либо берите -w по числу ядер и PARALLEL_WORKERS=1 (подсчет
+идет в самом обработчике, как выше), либо уменьшайте -w, оставляя пул.
+
+С --preload модуль импортируется один раз в главном процессе до создания
+процессов-обработчиков, поэтому тяжелые импорты и прогрев numba ниже выполняются
+однократно, а обработчики получают готовое состояние через fork. Процессы пула
+запускаются через forkserver/spawn и этого состояния не наследуют: они прогревают
+numba сами при старте (загружая код из дискового кэша numba).
+"""
+from app import app, warm_up_numba
+
+# Прогреваем скомпилированный подсчет слов, чтобы первый запрос в каждом обработчике
+# не ждал компиляции
+warm_up_numba()